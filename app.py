@@ -1,38 +1,136 @@
 import os
-import uuid
+import secrets
 import logging
-import tempfile
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import copy
 import shutil
+import filecmp
 import json
 import re
-from datetime import datetime, timedelta
+import glob
+import threading
+import time
+import queue
+import atexit
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import Future
+from urllib.parse import quote, urlsplit
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.middleware.proxy_fix import ProxyFix
 import yt_dlp
+from yt_dlp.utils import DownloadError, ExtractorError, GeoRestrictedError, UnsupportedError
+import orjson
 from flask_cors import CORS
+from flask_compress import Compress
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from cachetools import TTLCache
+
+# Under gunicorn's gevent worker, blocking yt-dlp work goes to gevent's pool
+# of real OS threads so it can't stall the event loop
+try:
+    from gevent import monkey
+    GEVENT_PATCHED = monkey.is_module_patched('threading')
+except ImportError:
+    GEVENT_PATCHED = False
+if GEVENT_PATCHED:
+    from gevent.threadpool import ThreadPoolExecutor
+else:
+    from concurrent.futures import ThreadPoolExecutor
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Serialize jsonify() responses and parse request JSON with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        # Keys stay sorted like Flask's default provider; always compact
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Flask app with proper proxy configuration for production
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Compress larger JSON payloads (e.g. carousel info); media files are
+# already compressed formats and are left alone
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
+# With REDIS_URL set, /api/download is limited through Flask-Limiter so all
+# gunicorn workers share one count per IP; otherwise each worker keeps its
+# own in-process count (see check_rate_limit)
+REDIS_URL = os.environ.get('REDIS_URL')
+limiter = Limiter(get_remote_address, app=app, storage_uri=REDIS_URL or 'memory://',
+                  strategy='moving-window', enabled=bool(REDIS_URL))
+
+# Let a fronting web server (Apache mod_xsendfile, lighttpd, ...) send file
+# bodies itself with sendfile(2) instead of streaming them through Python.
+# For nginx, X_ACCEL_REDIRECT_PREFIX names an `internal` location aliased to
+# DOWNLOAD_FOLDER and responses carry X-Accel-Redirect instead.
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '').rstrip('/')
+app.config['USE_X_SENDFILE'] = (bool(X_ACCEL_REDIRECT_PREFIX)
+                                or os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes'))
+
 # Configuration
 DOWNLOAD_FOLDER = 'downloads'
 LOG_FOLDER = 'logs'
 MAX_FILE_AGE_HOURS = 1
+CLEANUP_INTERVAL_MINUTES = 30
 MAX_FILE_SIZE_MB = 100
 RATE_LIMIT_PER_HOUR = 50
 
+# Scratch space for in-flight downloads. Kept inside DOWNLOAD_FOLDER so
+# finished files are published with a rename instead of a copy.
+TEMP_FOLDER = os.path.join(DOWNLOAD_FOLDER, '.tmp')
+
+# Supported Instagram URLs: posts, reels, stories (incl. highlights) and TV.
+# Checked before any yt-dlp call so junk URLs never reach extractor matching.
+INSTAGRAM_URL_RE = re.compile(
+    r'https?://(?:www\.)?instagram\.com/(?:(?:p|reel|stories|story)/[^/]+|tv/[\w-]+)',
+    re.IGNORECASE
+)
+
+# Content types for served media, keyed by lowercase extension
+MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4v': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.heic': 'image/heic',
+}
+# Downloaded files with these extensions are reported as videos
+VIDEO_EXTENSIONS = frozenset(ext for ext, mime in MIME_TYPES.items() if mime.startswith('video/'))
+
+# Anything other than letters, digits, space, '.', '_' and '-' is stripped
+# from filenames (\w is exactly str.isalnum() plus the underscore)
+UNSAFE_FILENAME_CHARS_RE = re.compile(r'[^\w .-]')
+
 # Cookie file paths (checked in order)
 COOKIES_FILE_PATHS = [
     '/etc/secrets/cookies.txt',  # Render Secret Files (read-only)
     './cookies.txt',             # Local development
     '/tmp/cookies.txt'           # Temporary fallback
 ]
+# Where a read-only secret is copied so yt-dlp can write the jar back
+COOKIES_COPY_PATH = '/tmp/cookies.txt'
 
 def get_cookies_file_path():
     """Find cookies file and copy to writable location if needed"""
-    writable_path = '/tmp/cookies.txt'
+    writable_path = COOKIES_COPY_PATH
     
     # Check all possible paths
     for path in COOKIES_FILE_PATHS:
@@ -40,472 +138,835 @@ def get_cookies_file_path():
             try:
                 size = os.path.getsize(path)
                 if size > 0:
-                    logger.info(f"✓ Found cookies file: {path} ({size} bytes)")
+                    logger.info("✓ Found cookies file: %s (%s bytes)", path, size)
                     
                     # If it's in read-only /etc/secrets, copy to /tmp
                     if path.startswith('/etc/secrets/'):
                         try:
-                            shutil.copy2(path, writable_path)
-                            logger.info(f"✓ Copied cookies to writable location: {writable_path}")
+                            # Workers share the copy: leave an identical one
+                            # alone, and swap in a new one atomically so no
+                            # worker ever reads a half-written jar
+                            if not (os.path.exists(writable_path)
+                                    and filecmp.cmp(path, writable_path, shallow=False)):
+                                staging_path = f'{writable_path}.{os.getpid()}'
+                                shutil.copyfile(path, staging_path)
+                                os.replace(staging_path, writable_path)
+                                logger.info("✓ Copied cookies to writable location: %s", writable_path)
                             return writable_path
                         except Exception as e:
-                            logger.error(f"Failed to copy cookies: {str(e)}")
+                            logger.error("Failed to copy cookies: %s", e)
                             return None
                     else:
                         # Already in writable location
                         return path
                 else:
-                    logger.warning(f"⚠️ Cookies file is empty: {path}")
+                    logger.warning("⚠️ Cookies file is empty: %s", path)
             except Exception as e:
-                logger.error(f"Error checking cookies file {path}: {str(e)}")
+                logger.error("Error checking cookies file %s: %s", path, e)
     
     logger.warning("⚠️ No valid cookies file found")
-    logger.warning(f"Searched paths: {COOKIES_FILE_PATHS}")
+    logger.warning("Searched paths: %s", COOKIES_FILE_PATHS)
     return None
 
 # Create necessary directories
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+os.makedirs(TEMP_FOLDER, exist_ok=True)
 os.makedirs(LOG_FOLDER, exist_ok=True)
 
-# Setup logging
+# Setup logging: request threads only enqueue records, a background
+# listener thread does the actual file/console writes
 log_file = os.path.join(LOG_FOLDER, 'igdl.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8')
+stream_handler = logging.StreamHandler()
+for handler in (file_handler, stream_handler):
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+root_logger = logging.getLogger()
+# LOG_LEVEL=WARNING turns the per-request info logs into a cheap level check.
+# An unknown name falls back to INFO rather than failing every worker's import.
+log_level_name = (os.environ.get('LOG_LEVEL') or 'INFO').upper()
+log_level = logging.getLevelNamesMapping().get(log_level_name)
+root_logger.setLevel(logging.INFO if log_level is None else log_level)
+root_logger.addHandler(QueueHandler(log_queue))
 logger = logging.getLogger('IGDL')
+if log_level is None:
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", log_level_name)
+
+def get_cookies_signature():
+    """(path, mtime, size) of each cookies source file, to spot replacements.
+
+    COOKIES_COPY_PATH is left out while a secret is being copied there: every
+    worker rewrites that copy when it (re)loads cookies, which would look
+    like a change to all the others and keep them reloading.
+    """
+    signature = []
+    for path in COOKIES_FILE_PATHS:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if path == COOKIES_COPY_PATH and any(
+                source.startswith('/etc/secrets/') and size > 0 for source, _, size in signature):
+            continue
+        signature.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
 
 # Initialize cookies path
 COOKIES_FILE_PATH = get_cookies_file_path()
+# The path is fixed after startup, so check it once instead of per request;
+# refresh_cookies re-checks it from the cleanup thread
+COOKIES_AVAILABLE = COOKIES_FILE_PATH is not None and os.path.isfile(COOKIES_FILE_PATH)
+_cookies_signature = get_cookies_signature()
+
+# In-process rate limiting is a token bucket per IP. A full bucket allows a
+# burst of RATE_LIMIT_BURST downloads and the rest of the hourly allowance
+# trickles in evenly, so no 60-minute window can exceed RATE_LIMIT_PER_HOUR
+# (burst + refill over an hour == RATE_LIMIT_PER_HOUR).
+RATE_LIMIT_BURST = max(1, RATE_LIMIT_PER_HOUR // 5)
+RATE_LIMIT_REFILL_PER_SECOND = (RATE_LIMIT_PER_HOUR - RATE_LIMIT_BURST) / 3600
+
+# Rate limiting storage: per-IP (tokens, last_refill).
+# A bucket refills completely within an hour, so entries expire an hour
+# after an IP's last download (an evicted IP comes back with a full bucket,
+# same as if it had been kept) and the number of tracked IPs is capped.
+download_tracker = TTLCache(maxsize=100_000, ttl=3600)
+_rate_limit_lock = threading.Lock()
+
+# Recent media info results keyed by normalized URL (LRU with a 5 minute TTL)
+media_info_cache = TTLCache(maxsize=2048, ttl=300)
+# Raw extractor results behind those results (before format selection),
+# reused by a follow-up download. Shorter TTL so the signed CDN URLs inside
+# are still valid.
+extracted_info_cache = TTLCache(maxsize=256, ttl=120)
+# Recent lasting failures (private, removed, unsupported posts) keyed the
+# same way, so retrying clients don't re-probe Instagram for them
+media_info_failures = TTLCache(maxsize=512, ttl=600)
+_media_info_lock = threading.Lock()
 
-# Rate limiting storage
-download_tracker = {}
+# Running totals for DOWNLOAD_FOLDER, updated as files are stored and
+# cleaned up so /api/stats never has to rescan the folder
+folder_stats = {'count': 0, 'bytes': 0}
+# Files stored since the current sweep started listing the folder, which its
+# snapshot may have missed (see reset_folder_state)
+files_stored_since_sweep = {}
+_stats_lock = threading.Lock()
+
+# Stored filenames grouped by the name before their unique suffix (see
+# sanitize_filename), so the /download fallback is a dict lookup
+filename_index = defaultdict(list)
+_filename_index_lock = threading.Lock()
+
+# Per-thread yt-dlp instances (see get_ydl). Bumping the generation makes
+# every thread build a fresh instance, e.g. after the cookies change.
+_ydl_local = threading.local()
+_ydl_generation = 0
+
+# Worker threads for blocking yt-dlp calls (see run_blocking)
+ydl_executor = ThreadPoolExecutor(max_workers=8)
+
+# In-flight work keyed by normalized URL (see run_single_flight)
+_inflight = {}
+_inflight_lock = threading.Lock()
 
 def sanitize_filename(filename):
     """Enhanced filename sanitization with unique ID"""
-    keepchars = (' ', '.', '_', '-')
-    filename = "".join(c for c in filename if c.isalnum() or c in keepchars).rstrip()
+    filename = UNSAFE_FILENAME_CHARS_RE.sub('', filename).rstrip()
     name, ext = os.path.splitext(filename)
-    unique_id = str(uuid.uuid4())[:8]
+    unique_id = secrets.token_hex(4)
     return f"{name}_{unique_id}{ext}"
 
+def get_filename_base(filename):
+    """Strip the unique suffix sanitize_filename adds (and the extension)"""
+    return filename.rsplit('_', 1)[0]
+
+def record_stored_file(filename, file_size):
+    """Add a file just published to DOWNLOAD_FOLDER to the totals and index"""
+    # Same lock order as reset_folder_state, so a store is either fully
+    # before or fully after a resync
+    with _stats_lock, _filename_index_lock:
+        folder_stats['count'] += 1
+        folder_stats['bytes'] += file_size
+        files_stored_since_sweep[filename] = file_size
+        filename_index[get_filename_base(filename)].append(filename)
+
+def reset_folder_state(stored_files):
+    """Rebuild folder_stats and filename_index from (name, size) pairs"""
+    with _stats_lock, _filename_index_lock:
+        # Keep files stored while the folder was being listed
+        listed = {name for name, _ in stored_files}
+        stored_files = stored_files + [(name, size) for name, size in files_stored_since_sweep.items()
+                                       if name not in listed]
+        folder_stats['count'] = len(stored_files)
+        folder_stats['bytes'] = sum(size for _, size in stored_files)
+        filename_index.clear()
+        for name, _ in stored_files:
+            filename_index[get_filename_base(name)].append(name)
+
 def check_rate_limit(ip_address):
-    """Rate limiting per IP"""
-    current_time = datetime.now()
-    
-    if ip_address not in download_tracker:
-        download_tracker[ip_address] = []
-    
-    # Remove entries older than 1 hour
-    download_tracker[ip_address] = [
-        timestamp for timestamp in download_tracker[ip_address]
-        if current_time - timestamp < timedelta(hours=1)
-    ]
-    
-    if len(download_tracker[ip_address]) >= RATE_LIMIT_PER_HOUR:
-        return False
+    """Rate limiting per IP (token bucket of RATE_LIMIT_BURST downloads,
+    refilled so an hour never allows more than RATE_LIMIT_PER_HOUR)"""
+    now = time.monotonic()
     
-    download_tracker[ip_address].append(current_time)
-    return True
+    with _rate_limit_lock:
+        tokens, last_refill = download_tracker.get(ip_address, (RATE_LIMIT_BURST, now))
+        tokens = min(RATE_LIMIT_BURST, tokens + (now - last_refill) * RATE_LIMIT_REFILL_PER_SECOND)
+        if tokens < 1:
+            # Refused requests don't touch the entry, so its TTL keeps running
+            return False
+        
+        # Re-inserting refreshes the entry's TTL
+        download_tracker[ip_address] = (tokens - 1, now)
+        return True
 
 def cleanup_old_files():
     """Remove files older than MAX_FILE_AGE_HOURS"""
     try:
-        current_time = datetime.now().timestamp()
+        current_time = time.time()
         deleted_count = 0
+        kept_files = []
+        with _stats_lock:
+            files_stored_since_sweep.clear()
+        
+        # TEMP_FOLDER only holds leftovers from downloads killed mid-request
+        for folder in (DOWNLOAD_FOLDER, TEMP_FOLDER):
+            # scandir hands back type info from the directory read, so only one stat per file
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    # Every gunicorn worker sweeps the same folder, so another
+                    # worker may remove a file between listing and stat/unlink
+                    try:
+                        file_stat = entry.stat(follow_symlinks=False)
+                        file_age_hours = (current_time - file_stat.st_mtime) / 3600
+                        if file_age_hours > MAX_FILE_AGE_HOURS:
+                            os.remove(entry.path)
+                            deleted_count += 1
+                            logger.info("Auto-deleted old file: %s", entry.name)
+                        elif folder == DOWNLOAD_FOLDER:
+                            kept_files.append((entry.name, file_stat.st_size))
+                    except FileNotFoundError:
+                        continue
         
-        for filename in os.listdir(DOWNLOAD_FOLDER):
-            file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                file_age_hours = (current_time - os.path.getmtime(file_path)) / 3600
-                if file_age_hours > MAX_FILE_AGE_HOURS:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    logger.info(f"Auto-deleted old file: {filename}")
+        # Between sweeps this worker's totals only see its own downloads;
+        # resync them with what is actually left in the shared folder
+        reset_folder_state(kept_files)
         
         if deleted_count > 0:
-            logger.info(f"Cleanup: Deleted {deleted_count} old files")
+            logger.info("Cleanup: Deleted %s old files", deleted_count)
             
         return deleted_count
     except Exception as e:
-        logger.error(f"Cleanup error: {str(e)}")
+        logger.error("Cleanup error: %s", e)
         return 0
 
-def get_ydl_opts(download=False, output_dir=None):
+def scan_download_folder():
+    """List (name, size) for the files currently in DOWNLOAD_FOLDER"""
+    with os.scandir(DOWNLOAD_FOLDER) as entries:
+        return [(entry.name, entry.stat(follow_symlinks=False).st_size)
+                for entry in entries if entry.is_file(follow_symlinks=False)]
+
+# Seed the running totals and index with whatever survived a restart
+reset_folder_state(scan_download_folder())
+
+# Static yt-dlp options shared by every request (enhanced Instagram support).
+# get_ydl_opts() returns a shallow copy, so nested dicts must not be mutated.
+BASE_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+        'Sec-Fetch-Mode': 'navigate',
+        'Referer': 'https://www.instagram.com/',
+    },
+    'socket_timeout': 30,
+    'retries': 3,
+    'fragment_retries': 3,
+    'skip_unavailable_fragments': True,
+    'extractor_args': {
+        'instagram': {
+            'format': 'best',
+            'post_filter': 'none'
+        }
+    },
+}
+
+def get_ydl_opts(download=False, output_prefix=None):
     """Get yt-dlp options with enhanced Instagram support"""
-    opts = {
-        'quiet': True,
-        'no_warnings': False,
-        'extract_flat': False,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-us,en;q=0.5',
-            'Sec-Fetch-Mode': 'navigate',
-            'Referer': 'https://www.instagram.com/',
-        },
-        'socket_timeout': 30,
-        'retries': 3,
-        'fragment_retries': 3,
-        'skip_unavailable_fragments': True,
-        'ignoreerrors': True,
-        'extractor_args': {
-            'instagram': {
-                'format': 'best',
-                'post_filter': 'none'
-            }
-        },
-    }
+    opts = BASE_YDL_OPTS.copy()
     
-    if download and output_dir:
-        opts['outtmpl'] = os.path.join(output_dir, '%(title)s.%(ext)s')
-        # Enhanced format selection for Instagram
-        opts['format'] = 'best[filesize<?100M]/best'
+    if download and output_prefix:
+        opts['outtmpl'] = f'{output_prefix}%(title)s.%(ext)s'
+        # Prefer a variant under the size cap; anything bigger is left to
+        # reach the explicit size check so the client gets a clear 413
+        opts['format'] = f'best[filesize<?{MAX_FILE_SIZE_MB}M]/best'
         opts['merge_output_format'] = 'mp4'
     
     # Add cookies if available
-    if COOKIES_FILE_PATH and os.path.exists(COOKIES_FILE_PATH):
+    if COOKIES_AVAILABLE:
         opts['cookiefile'] = COOKIES_FILE_PATH
-        logger.info("Using cookies for Instagram request")
-    else:
-        logger.warning("No cookies available - private content may fail")
     
     return opts
 
+def get_url_key(url):
+    """Normalize an Instagram URL for use as a cache/dedup key"""
+    # Shortcodes are case-sensitive, so only scheme and host are lowercased
+    parts = urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path.rstrip('/')}"
+
+def run_blocking(func, *args):
+    """Run blocking yt-dlp work on ydl_executor and wait for the result.
+
+    CPU-heavy extraction and ffmpeg merges then run on real threads, which
+    also keeps get_ydl's per-thread YoutubeDL instances reused (under gevent
+    each request is a new greenlet with its own thread-locals).
+    """
+    return ydl_executor.submit(func, *args).result()
+
+def run_single_flight(key, func, *args):
+    """Run func(*args) once for concurrent callers sharing the same key.
+
+    The first caller does the work; anyone arriving while it is in flight
+    waits for and reuses its result (or exception).
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[key] = future
+    
+    if not is_owner:
+        logger.info("Joining in-flight request for: %s", key)
+        return future.result()
+    
+    try:
+        result = func(*args)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        # Waiters must never be left blocked, even when the owner is killed
+        # (gevent.Timeout, GreenletExit, KeyboardInterrupt). Those aren't
+        # the waiters' to handle, so they get a plain error instead.
+        if isinstance(e, Exception):
+            future.set_exception(e)
+        else:
+            interrupted = RuntimeError(f"In-flight request was interrupted: {e!r}")
+            interrupted.__cause__ = e
+            future.set_exception(interrupted)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def get_ydl(download=False):
+    """Get this thread's reusable YoutubeDL instance.
+
+    Keeping the instance alive keeps yt-dlp's HTTP connection pool (and TLS
+    sessions) to Instagram warm between requests instead of reconnecting on
+    every call. Instances are per-thread because YoutubeDL is not thread-safe.
+    """
+    key = 'download' if download else 'info'
+    generation, ydl = getattr(_ydl_local, key, (None, None))
+    if ydl is None or generation != _ydl_generation:
+        if download:
+            # outtmpl is set per download by the caller
+            ydl_opts = get_ydl_opts(download=True, output_prefix=os.path.join(TEMP_FOLDER, ''))
+            ydl_opts.update({
+                'ignoreerrors': True,
+                'no_overwrites': True,
+                # Abort files whose size is only known once the download starts
+                'max_filesize': MAX_FILE_SIZE_MB * 1024 * 1024,
+                # Start reads at 1 MiB instead of yt-dlp's 1 KiB default
+                'buffersize': 1024 * 1024,
+            })
+        else:
+            # Enhanced yt-dlp options for Instagram. Unlike the download
+            # instance this one leaves ignoreerrors off (BASE_YDL_OPTS doesn't
+            # set it): a failed extraction should raise a DownloadError that
+            # describe_ytdlp_error can classify, not come back as None.
+            ydl_opts = get_ydl_opts()
+            ydl_opts.update({
+                # Info only needs each item's shallow metadata, so don't
+                # resolve playlist entries that are just URL references
+                'extract_flat': 'in_playlist',
+            })
+        ydl = yt_dlp.YoutubeDL(ydl_opts)
+        setattr(_ydl_local, key, (_ydl_generation, ydl))
+    return ydl
+
 def is_valid_instagram_url(url):
     """Enhanced Instagram URL validation"""
-    instagram_patterns = [
-        r'https?://(www\.)?instagram\.com/(p|reel|stories|story)/[^/]+/?',
-        r'https?://(www\.)?instagram\.com/stories/highlight/[\w_-]+/?',
-        r'https?://(www\.)?instagram\.com/tv/[\w_-]+/?',
-        r'https?://(www\.)?instagram\.com/reel/[\w_-]+/?'
-    ]
+    return INSTAGRAM_URL_RE.match(url) is not None
+
+def build_media_item(entry, index, default_id, default_title, default_thumbnail=''):
+    """Describe one post or carousel item for the media info response"""
+    get = entry.get
+    
+    # Get the best available URL for the item
+    media_url = get('url')
+    if not media_url:
+        formats = get('formats')
+        if formats:
+            media_url = formats[-1].get('url')  # Usually the last one is best
+    
+    duration = get('duration', 0)
+    # yt-dlp reports a missing duration as None for images
+    is_video = (duration or 0) > 0
     
-    for pattern in instagram_patterns:
-        if re.match(pattern, url, re.IGNORECASE):
-            return True
-    return False
+    return {
+        'id': get('id', default_id),
+        'title': get('title', default_title),
+        'thumbnail': get('thumbnail', default_thumbnail),
+        'duration': duration,
+        'width': get('width', 0),
+        'height': get('height', 0),
+        'url': media_url,
+        'index': index,
+        'is_video': is_video,
+        'ext': get('ext', 'mp4' if is_video else 'jpg')
+    }
+
+# Fallback for yt-dlp errors whose type doesn't say what went wrong: the
+# first entry with a phrase found in the (lowercased) message wins
+YTDLP_ERROR_MESSAGES = (
+    (('private', 'login'), "This content is private or requires login. Make sure you're using valid cookies."),
+    (('not found', 'not available', 'removed'), "This content is not available or has been removed from Instagram."),
+    (('url could be wrong',), "Invalid Instagram URL. Please check the URL and try again."),
+    (('no video formats found',), "This post format is not supported. The post might contain content that cannot be downloaded (like some carousels or restricted content). Try a different post."),
+    (('rate limit',), "Rate limit exceeded. Please try again later."),
+)
+
+# HTTP statuses behind an ExtractorError, mapped to the same messages
+YTDLP_HTTP_ERROR_MESSAGES = {
+    401: YTDLP_ERROR_MESSAGES[0][1],
+    403: YTDLP_ERROR_MESSAGES[0][1],
+    404: YTDLP_ERROR_MESSAGES[1][1],
+    410: YTDLP_ERROR_MESSAGES[1][1],
+    429: YTDLP_ERROR_MESSAGES[4][1],
+}
+
+YTDLP_UNSUPPORTED_MESSAGE = "This Instagram URL format is not supported."
+YTDLP_GEO_MESSAGE = "This content is not available in the server's region."
+
+# Failures a retry minutes later won't fix (unlike rate limits or network
+# trouble), so they are remembered in media_info_failures
+PERSISTENT_YTDLP_ERRORS = frozenset(
+    [message for _, message in YTDLP_ERROR_MESSAGES[:4]]
+    + [YTDLP_UNSUPPORTED_MESSAGE, YTDLP_GEO_MESSAGE]
+)
+
+def describe_ytdlp_error(e, prefix):
+    """User-facing message for a yt-dlp DownloadError"""
+    # DownloadError wraps the extractor's exception; dispatch on that first
+    cause = e.exc_info[1] if e.exc_info else None
+    if isinstance(cause, UnsupportedError):
+        return YTDLP_UNSUPPORTED_MESSAGE
+    if isinstance(cause, GeoRestrictedError):
+        return YTDLP_GEO_MESSAGE
+    if isinstance(cause, ExtractorError):
+        status = getattr(getattr(cause, 'cause', None), 'status', None)
+        if status in YTDLP_HTTP_ERROR_MESSAGES:
+            return YTDLP_HTTP_ERROR_MESSAGES[status]
+
+    error_msg = str(e)
+    lowered = error_msg.lower()
+    for phrases, message in YTDLP_ERROR_MESSAGES:
+        if any(phrase in lowered for phrase in phrases):
+            return message
+    return f"{prefix}: {error_msg}"
+
+def process_extracted_info(ydl, raw_info):
+    """Run format selection on a copy of a raw (process=False) extractor result.
+
+    Processing fills in the chosen formats in place, so every YoutubeDL
+    selects from its own copy. Errors are reported the way extract_info does,
+    as a DownloadError or, with ignoreerrors, a None result.
+    """
+    try:
+        return ydl.process_ie_result(copy.deepcopy(raw_info), download=False)
+    except ExtractorError as e:
+        ydl.report_error(str(e), e.format_traceback())
+        return None
 
 def get_media_info_ytdlp(url):
     """Get media information without downloading with enhanced error handling"""
+    cache_key = get_url_key(url)
+    with _media_info_lock:
+        cached = media_info_cache.get(cache_key)
+        failure = media_info_failures.get(cache_key)
+    if cached is not None:
+        logger.info("Media info cache hit: %s", url)
+        return cached
+    if failure is not None:
+        logger.info("Media info failure cache hit: %s", url)
+        raise Exception(failure)
+    
     try:
-        # Enhanced yt-dlp options for Instagram
-        ydl_opts = get_ydl_opts()
-        ydl_opts.update({
-            'extract_flat': False,
-            'force_json': True,
-            'ignoreerrors': True,
-        })
+        ydl = get_ydl()
+        logger.info("Fetching info for: %s", url)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Fetching info for: {url}")
-            
-            # Test if URL is accessible first
+        # The one real network round trip. Format selection runs separately
+        # so the raw result can be cached for a download to select from.
+        raw_info = ydl.extract_info(url, download=False, process=False)
+        info = process_extracted_info(ydl, raw_info) if raw_info is not None else None
+        
+        # CRITICAL FIX: Check if info is None before processing
+        if info is None:
+            raise Exception("Could not extract media information. This post format may not be supported.")
+        
+        # Parse upload date
+        upload_date = info.get('upload_date', '')
+        if upload_date:
             try:
-                info = ydl.extract_info(url, download=False)
-            except yt_dlp.utils.DownloadError as e:
-                error_msg = str(e)
-                logger.error(f"yt-dlp extraction failed: {error_msg}")
-                
-                # More specific error messages
-                if "Private" in error_msg or "login" in error_msg:
-                    raise Exception("This content is private or requires login. Make sure you're using valid cookies.")
-                elif "not found" in error_msg.lower() or "removed" in error_msg.lower():
-                    raise Exception("This content is not available or has been removed from Instagram.")
-                elif "URL could be wrong" in error_msg:
-                    raise Exception("Invalid Instagram URL. Please check the URL and try again.")
-                elif "Unsupported URL" in error_msg:
-                    raise Exception("This Instagram URL format is not supported.")
-                elif "No video formats found" in error_msg:
-                    raise Exception("This post contains content that cannot be downloaded. Try a different post.")
-                else:
-                    raise Exception(f"Instagram returned an error: {error_msg}")
-            
-            # CRITICAL FIX: Check if info is None before processing
-            if info is None:
-                raise Exception("Could not extract media information. This post format may not be supported.")
-            
-            # Parse upload date
-            upload_date = info.get('upload_date', '')
-            if upload_date:
-                try:
-                    upload_date = datetime.strptime(upload_date, '%Y%m%d').strftime('%Y-%m-%d')
-                except:
-                    upload_date = 'Unknown'
-            
-            # Enhanced carousel detection with robust error handling
-            is_carousel = False
-            media_count = 1
-            carousel_media = []
-            
-            # Check for playlist (carousel)
-            if info.get('_type') == 'playlist':
-                is_carousel = True
-                entries = info.get('entries', [])
-                # Filter out None entries and count valid ones
-                valid_entries = [entry for entry in entries if entry is not None]
-                media_count = len(valid_entries) if valid_entries else 1
-                
-                if valid_entries:
-                    for i, entry in enumerate(valid_entries):
-                        # Get the best available URL for each media item
-                        media_url = None
-                        if entry.get('url'):
-                            media_url = entry.get('url')
-                        elif entry.get('formats'):
-                            # Get the best format URL
-                            formats = entry.get('formats', [])
-                            if formats:
-                                best_format = formats[-1]  # Usually the last one is best
-                                media_url = best_format.get('url')
-                        
-                        carousel_media.append({
-                            'id': entry.get('id', f'item_{i}'),
-                            'title': entry.get('title', f'Media {i+1}'),
-                            'thumbnail': entry.get('thumbnail', info.get('thumbnail', '')),
-                            'duration': entry.get('duration', 0),
-                            'width': entry.get('width', 0),
-                            'height': entry.get('height', 0),
-                            'url': media_url,
-                            'index': i,
-                            'is_video': entry.get('duration', 0) > 0,
-                            'ext': entry.get('ext', 'mp4' if entry.get('duration', 0) > 0 else 'jpg')
-                        })
-            else:
-                # Single media item
-                media_url = info.get('url')
-                if not media_url and info.get('formats'):
-                    formats = info.get('formats', [])
-                    if formats:
-                        best_format = formats[-1]
-                        media_url = best_format.get('url')
-                
-                carousel_media.append({
-                    'id': info.get('id', 'single'),
-                    'title': info.get('title', 'Instagram Media'),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'duration': info.get('duration', 0),
-                    'width': info.get('width', 0),
-                    'height': info.get('height', 0),
-                    'url': media_url,
-                    'index': 0,
-                    'is_video': info.get('duration', 0) > 0,
-                    'ext': info.get('ext', 'mp4' if info.get('duration', 0) > 0 else 'jpg')
-                })
-                media_count = 1
-                is_carousel = False
-            
-            # If no carousel media was added (all entries were None), create a basic response
-            if not carousel_media:
-                carousel_media.append({
-                    'id': info.get('id', 'single'),
-                    'title': info.get('title', 'Instagram Media'),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'duration': info.get('duration', 0),
-                    'width': info.get('width', 0),
-                    'height': info.get('height', 0),
-                    'url': url,
-                    'index': 0,
-                    'is_video': info.get('duration', 0) > 0,
-                    'ext': 'mp4' if info.get('duration', 0) > 0 else 'jpg'
-                })
-            
-            result = {
-                'title': info.get('title', 'Instagram Media'),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Unknown'),
-                'upload_date': upload_date,
-                'like_count': info.get('like_count', 0),
-                'comment_count': info.get('comment_count', 0),
-                'description': info.get('description', ''),
-                'duration': info.get('duration', 0),
-                'is_carousel': is_carousel,
-                'media_count': media_count,
-                'carousel_media': carousel_media,
-                'url': url
-            }
-            
-            logger.info(f"Info retrieved: {result['title']} - {media_count} media items")
-            return result
+                upload_date = datetime.strptime(upload_date, '%Y%m%d').strftime('%Y-%m-%d')
+            except:
+                upload_date = 'Unknown'
+        
+        # Enhanced carousel detection with robust error handling
+        is_carousel = False
+        media_count = 1
+        carousel_media = []
+        
+        # Check for playlist (carousel)
+        if info.get('_type') == 'playlist':
+            is_carousel = True
+            entries = info.get('entries', [])
+            # Filter out None entries and count valid ones
+            valid_entries = [entry for entry in entries if entry is not None]
+            media_count = len(valid_entries) if valid_entries else 1
             
-    except yt_dlp.utils.DownloadError as e:
-        error_msg = str(e)
-        logger.error(f"yt-dlp download error: {error_msg}")
-        
-        # Enhanced error handling for Instagram
-        if "No video formats found" in error_msg:
-            raise Exception("This post format is not supported. The post might contain content that cannot be downloaded (like some carousels or restricted content). Try a different post.")
-        elif "not available" in error_msg.lower():
-            raise Exception("This content is not available or has been deleted")
-        elif "private" in error_msg.lower():
-            raise Exception("This content is private or requires login")
-        elif "rate limit" in error_msg.lower():
-            raise Exception("Rate limit exceeded. Please try again later.")
+            default_thumbnail = info.get('thumbnail', '')
+            carousel_media = [
+                build_media_item(entry, i, f'item_{i}', f'Media {i+1}', default_thumbnail)
+                for i, entry in enumerate(valid_entries)
+            ]
         else:
-            raise Exception(f"Failed to fetch media: {error_msg}")
+            # Single media item
+            carousel_media.append(build_media_item(info, 0, 'single', 'Instagram Media'))
+            media_count = 1
+            is_carousel = False
+        
+        # If no carousel media was added (all entries were None), create a basic response
+        if not carousel_media:
+            fallback_item = build_media_item(info, 0, 'single', 'Instagram Media')
+            # The post itself has no media URL, so point at the post
+            fallback_item['url'] = url
+            carousel_media.append(fallback_item)
+        
+        result = {
+            'title': info.get('title', 'Instagram Media'),
+            'thumbnail': info.get('thumbnail', ''),
+            'uploader': info.get('uploader', 'Unknown'),
+            'upload_date': upload_date,
+            'like_count': info.get('like_count', 0),
+            'comment_count': info.get('comment_count', 0),
+            'description': info.get('description', ''),
+            'duration': info.get('duration', 0),
+            'is_carousel': is_carousel,
+            'media_count': media_count,
+            'carousel_media': carousel_media,
+            'url': url
+        }
+        
+        logger.info("Info retrieved: %s - %s media items", result['title'], media_count)
+        with _media_info_lock:
+            media_info_cache[cache_key] = result
+            extracted_info_cache[cache_key] = raw_info
+        return result
+        
+    except DownloadError as e:
+        logger.error("yt-dlp extraction failed: %s", e)
+        message = describe_ytdlp_error(e, "Instagram returned an error")
+        if message in PERSISTENT_YTDLP_ERRORS:
+            with _media_info_lock:
+                media_info_failures[cache_key] = message
+        raise Exception(message)
     except Exception as e:
-        logger.error(f"Error getting media info: {str(e)}")
+        logger.error("Error getting media info: %s", e)
         raise e
 
+def remove_temp_files(output_prefix):
+    """Remove any files left in TEMP_FOLDER for a download prefix"""
+    for leftover in glob.glob(f'{output_prefix}*'):
+        try:
+            os.remove(leftover)
+        except OSError as e:
+            logger.warning("Could not remove temp file %s: %s", leftover, e)
+
+def get_largest_estimated_size(info):
+    """Estimate the biggest single file, in bytes, from yt-dlp's selected formats.
+
+    MAX_FILE_SIZE_MB caps each stored file, so carousel items are measured
+    one by one rather than summed.
+    """
+    entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+    
+    largest_size = 0
+    for entry in entries or []:
+        if not entry:
+            continue
+        # Merged downloads list their video/audio parts in requested_formats
+        entry_size = sum(fmt.get('filesize') or fmt.get('filesize_approx') or 0
+                         for fmt in entry.get('requested_formats') or [entry])
+        largest_size = max(largest_size, entry_size)
+    return largest_size
+
+def get_downloaded_files(info):
+    """Collect final file paths from yt-dlp's requested_downloads"""
+    entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+    
+    downloaded_files = []
+    for entry in entries or []:
+        # Failed carousel items come back as None with ignoreerrors
+        if not entry:
+            continue
+        for requested in entry.get('requested_downloads') or []:
+            if requested.get('filepath'):
+                downloaded_files.append(requested['filepath'])
+    return downloaded_files
+
+def skipped_for_size(info):
+    """Whether an item of unknown size came back from yt-dlp without a file.
+
+    max_filesize quietly aborts a transfer once the server reports a size
+    over the cap. Sizes yt-dlp knew upfront were already checked, so an
+    unsized item that wasn't written is taken to have hit the cap.
+    """
+    entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+    return any(
+        entry and get_largest_estimated_size(entry) == 0
+        and not any(requested.get('filepath') for requested in entry.get('requested_downloads') or [])
+        for entry in entries or []
+    )
+
+def extract_download_info(url):
+    """Resolve formats for a download without fetching any media"""
+    ydl = get_ydl(download=True)
+    
+    # Clients usually fetch /api/media/info right before downloading, so
+    # reuse that extraction and only redo format selection for download
+    cache_key = get_url_key(url)
+    with _media_info_lock:
+        cached = extracted_info_cache.get(cache_key)
+        failure = media_info_failures.get(cache_key)
+    if cached is not None:
+        logger.info("Reusing extracted info for: %s", url)
+        return process_extracted_info(ydl, cached)
+    if failure is not None:
+        logger.info("Known failing post, not downloading: %s", url)
+        raise Exception(failure)
+    
+    return ydl.extract_info(url, download=False)
+
+def download_entry(entry, output_prefix):
+    """Download one already-extracted post or carousel item"""
+    ydl = get_ydl(download=True)
+    ydl.params['outtmpl']['default'] = f'{output_prefix}%(title)s.%(ext)s'
+    return ydl.process_ie_result(entry, download=True)
+
+def store_downloaded_files(downloaded_files):
+    """Move finished downloads into DOWNLOAD_FOLDER and describe them"""
+    results = []
+    for downloaded_file in downloaded_files:
+        # Temp names look like {token}_{item}_{title}.{ext}
+        filename = os.path.basename(downloaded_file).split('_', 2)[2]
+        try:
+            file_size = os.path.getsize(downloaded_file)
+        except OSError:
+            logger.warning("Reported file is missing: %s", downloaded_file)
+            continue
+        
+        if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            logger.warning("File too large: %.2fMB", file_size / (1024*1024))
+            # Free the disk now rather than when the whole request finishes
+            os.unlink(downloaded_file)
+            continue
+        
+        safe_filename = sanitize_filename(filename)
+        final_path = os.path.join(DOWNLOAD_FOLDER, safe_filename)
+        os.replace(downloaded_file, final_path)
+        record_stored_file(safe_filename, file_size)
+        
+        file_type = 'video' if os.path.splitext(downloaded_file)[1].lower() in VIDEO_EXTENSIONS else 'image'
+        
+        results.append({
+            'filename': safe_filename,
+            'file_size': file_size,
+            'type': file_type,
+            'download_url': f'/download/{safe_filename}',
+            'original_name': filename,
+            'available': True
+        })
+    return results
+
 def download_media_ytdlp(url, item_index=None):
     """Download media using yt-dlp with enhanced error handling"""
-    temp_dir = None
+    # Files for this request share a unique prefix instead of a private temp dir
+    token = secrets.token_hex(16)
+    output_prefix = os.path.join(TEMP_FOLDER, f'{token}_')
     try:
-        temp_dir = tempfile.mkdtemp()
-        
-        # Enhanced yt-dlp options for better compatibility
-        ydl_opts = get_ydl_opts(download=True, output_dir=temp_dir)
-        ydl_opts.update({
-            'format': 'best[filesize<?50M]/best',
-            'ignoreerrors': True,
-            'no_overwrites': True,
-        })
+        logger.info("Downloading from: %s", url)
+        # Resolve formats first so oversized media is rejected before any bytes move
+        info = run_blocking(extract_download_info, url)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Downloading from: {url}")
-            info = ydl.extract_info(url, download=True)
-            
-            # CRITICAL FIX: Check if info is None
-            if info is None:
-                raise Exception("Could not download media. This post format may not be supported.")
-            
-            # Parse metadata
-            upload_date = info.get('upload_date', '')
-            if upload_date:
-                try:
-                    upload_date = datetime.strptime(upload_date, '%Y%m%d').strftime('%Y-%m-%d')
-                except:
-                    upload_date = 'Unknown'
-            
-            # Find downloaded files
-            downloaded_files = []
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    if file.endswith(('.mp4', '.jpg', '.jpeg', '.png', '.webp', '.mkv', '.avi')):
-                        downloaded_files.append(os.path.join(root, file))
-            
-            if not downloaded_files:
-                raise Exception("No files downloaded. This post format might not be supported.")
-            
-            # Process files
-            results = []
-            for downloaded_file in downloaded_files:
-                filename = os.path.basename(downloaded_file)
-                file_size = os.path.getsize(downloaded_file)
-                
-                if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-                    logger.warning(f"File too large: {file_size / (1024*1024):.2f}MB")
-                    continue
-                
-                safe_filename = sanitize_filename(filename)
-                final_path = os.path.join(DOWNLOAD_FOLDER, safe_filename)
-                shutil.move(downloaded_file, final_path)
-                
-                file_type = 'video' if downloaded_file.endswith(('.mp4', '.mkv', '.avi')) else 'image'
-                
-                results.append({
-                    'filename': safe_filename,
-                    'file_size': file_size,
-                    'type': file_type,
-                    'download_url': f'/download/{safe_filename}',
-                    'original_name': filename,
-                    'available': True
-                })
-            
-            shutil.rmtree(temp_dir)
-            
-            if not results:
-                raise Exception("No valid files downloaded. The post format might not be supported.")
-            
-            logger.info(f"Successfully downloaded {len(results)} file(s)")
-            
-            return {
-                'status': 'success',
-                'type': 'multiple' if len(results) > 1 else results[0]['type'],
-                'files': results,
-                'count': len(results),
-                'title': info.get('title', 'Instagram Media'),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Unknown'),
-                'upload_date': upload_date,
-                'like_count': info.get('like_count', 0),
-                'comment_count': info.get('comment_count', 0),
-                'description': info.get('description', ''),
-                'duration': info.get('duration', 0),
-                'is_carousel': info.get('_type') == 'playlist'
-            }
-            
-    except yt_dlp.utils.DownloadError as e:
-        error_msg = str(e)
-        logger.error(f"yt-dlp download error: {error_msg}")
+        # CRITICAL FIX: Check if info is None
+        if info is None:
+            raise Exception("Could not download media. This post format may not be supported.")
         
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            
-        # Enhanced error handling
-        if "No video formats found" in error_msg:
-            raise Exception("This post format is not supported. Try a different post or check if the content is available. Some carousel posts may not be downloadable.")
-        elif "private" in error_msg.lower():
-            raise Exception("This content is private or requires login")
-        elif "not available" in error_msg.lower():
-            raise Exception("This content is not available or has been removed")
+        estimated_size = get_largest_estimated_size(info)
+        if estimated_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            raise Exception(f"Media is too large ({estimated_size / (1024*1024):.2f}MB). Maximum allowed is {MAX_FILE_SIZE_MB}MB.")
+        
+        # Download carousel items concurrently from the already-extracted info.
+        # Each item gets its own prefix so items sharing a title never collide.
+        is_carousel = info.get('_type') == 'playlist'
+        entries = (info.get('entries') or []) if is_carousel else [info]
+        pending = [
+            ydl_executor.submit(download_entry, entry, f'{output_prefix}{index}_') if entry else None
+            for index, entry in enumerate(entries)
+        ]
+        
+        # Wait for every item before failing so cleanup never races a running download
+        downloaded_entries = []
+        download_error = None
+        for future in pending:
+            try:
+                downloaded_entries.append(future.result() if future else None)
+            except Exception as e:
+                downloaded_entries.append(None)
+                download_error = download_error or e
+        if download_error:
+            raise download_error
+        
+        if is_carousel:
+            info['entries'] = downloaded_entries
         else:
-            raise Exception(f"Download failed: {error_msg}")
+            info = downloaded_entries[0]
+        if info is None:
+            raise Exception("Could not download media. This post format may not be supported.")
+        
+        # Parse metadata
+        upload_date = info.get('upload_date', '')
+        if upload_date:
+            try:
+                upload_date = datetime.strptime(upload_date, '%Y%m%d').strftime('%Y-%m-%d')
+            except:
+                upload_date = 'Unknown'
+        
+        # Files yt-dlp reports having written (no directory scan needed)
+        downloaded_files = get_downloaded_files(info)
+        
+        if not downloaded_files:
+            if skipped_for_size(info):
+                raise Exception(f"Media is too large. Maximum allowed is {MAX_FILE_SIZE_MB}MB.")
+            raise Exception("No files downloaded. This post format might not be supported.")
+        
+        # Process files
+        results = run_blocking(store_downloaded_files, downloaded_files)
+        
+        if not results:
+            raise Exception("No valid files downloaded. The post format might not be supported.")
+        
+        logger.info("Successfully downloaded %s file(s)", len(results))
+        
+        return {
+            'status': 'success',
+            'type': 'multiple' if len(results) > 1 else results[0]['type'],
+            'files': results,
+            'count': len(results),
+            'title': info.get('title', 'Instagram Media'),
+            'thumbnail': info.get('thumbnail', ''),
+            'uploader': info.get('uploader', 'Unknown'),
+            'upload_date': upload_date,
+            'like_count': info.get('like_count', 0),
+            'comment_count': info.get('comment_count', 0),
+            'description': info.get('description', ''),
+            'duration': info.get('duration', 0),
+            'is_carousel': is_carousel
+        }
+        
+    except DownloadError as e:
+        logger.error("yt-dlp download error: %s", e)
+        raise Exception(describe_ytdlp_error(e, "Download failed"))
     except Exception as e:
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        logger.error(f"Download error: {str(e)}")
+        logger.error("Download error: %s", e)
         raise e
+    finally:
+        remove_temp_files(output_prefix)
 
-@app.before_request
-def before_request():
-    """Periodic cleanup"""
-    if not hasattr(app, '_last_cleanup'):
-        app._last_cleanup = datetime.now()
-    
-    if datetime.now() - app._last_cleanup > timedelta(minutes=30):
+def refresh_cookies():
+    """Pick up a cookies file that was added, replaced or removed after startup"""
+    global COOKIES_FILE_PATH, COOKIES_AVAILABLE, _cookies_signature, _ydl_generation
+    signature = get_cookies_signature()
+    if signature == _cookies_signature:
+        return
+    logger.info("Cookies file changed, reloading")
+    COOKIES_FILE_PATH = get_cookies_file_path()
+    COOKIES_AVAILABLE = COOKIES_FILE_PATH is not None and os.path.isfile(COOKIES_FILE_PATH)
+    _cookies_signature = signature
+    # YoutubeDL loads the cookie jar once, so cached instances must be rebuilt
+    _ydl_generation += 1
+    # Posts that failed as private may be reachable with the new cookies
+    with _media_info_lock:
+        media_info_failures.clear()
+
+def cleanup_loop():
+    """Periodic cleanup, run on a background thread instead of in requests"""
+    while True:
+        time.sleep(CLEANUP_INTERVAL_MINUTES * 60)
         cleanup_old_files()
-        app._last_cleanup = datetime.now()
+        try:
+            refresh_cookies()
+        except Exception as e:
+            logger.error("Cookies refresh error: %s", e)
+
+# Set DISABLE_BG_CLEANUP to keep tests/scripts from starting the thread
+if not os.environ.get('DISABLE_BG_CLEANUP'):
+    threading.Thread(target=cleanup_loop, name='file-cleanup', daemon=True).start()
 
 # ==================== API ROUTES ====================
 
+# Static API description served by the home page
+HOME_INFO = {
+    'status': 'running',
+    'service': 'IGDL API',
+    'version': '1.0.0',
+    'endpoints': {
+        'media_info': '/api/media/info',
+        'download': '/api/download',
+        'health': '/health',
+        'stats': '/api/stats'
+    }
+}
+
 @app.route('/')
 def home():
     """API home page"""
-    return jsonify({
-        'status': 'running',
-        'service': 'IGDL API',
-        'version': '1.0.0',
-        'endpoints': {
-            'media_info': '/api/media/info',
-            'download': '/api/download',
-            'health': '/health',
-            'stats': '/api/stats'
-        }
-    })
+    return jsonify(HOME_INFO)
 
 @app.route('/health')
 def health_check():
     """Health check for monitoring"""
-    cookies_ok = COOKIES_FILE_PATH is not None and os.path.exists(COOKIES_FILE_PATH)
-    
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'cookies_configured': cookies_ok,
-        'cookies_path': COOKIES_FILE_PATH if cookies_ok else None
+        'cookies_configured': COOKIES_AVAILABLE,
+        'cookies_path': COOKIES_FILE_PATH if COOKIES_AVAILABLE else None
     })
 
-@app.route('/api/media/info', methods=['POST', 'OPTIONS'])
+@app.route('/api/media/info', methods=['POST'])
 def get_media_info():
     """Get media information without downloading"""
-    if request.method == 'OPTIONS':
-        return '', 200
-        
     try:
         data = request.get_json()
         if not data or 'url' not in data:
@@ -520,15 +981,16 @@ def get_media_info():
                 'message': 'Invalid Instagram URL. Supported formats: Posts (instagram.com/p/...), Reels (instagram.com/reel/...), Stories (instagram.com/stories/...), TV (instagram.com/tv/...)'
             }), 400
 
-        if not COOKIES_FILE_PATH or not os.path.exists(COOKIES_FILE_PATH):
+        if not COOKIES_AVAILABLE:
             logger.warning("Attempting to fetch info without cookies")
 
-        media_info = get_media_info_ytdlp(url)
+        # Concurrent requests for the same post share one extraction
+        media_info = run_single_flight(('info', get_url_key(url)), run_blocking, get_media_info_ytdlp, url)
         return jsonify({'status': 'ok', 'media_info': media_info})
 
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Media info error: {error_msg}")
+        logger.error("Media info error: %s", error_msg)
         
         if 'private' in error_msg.lower() or 'login' in error_msg.lower():
             return jsonify({'status': 'error', 'message': 'This content is private or requires authentication'}), 401
@@ -541,19 +1003,13 @@ def get_media_info():
         else:
             return jsonify({'status': 'error', 'message': 'Failed to fetch media information'}), 500
 
-@app.route('/api/download', methods=['POST', 'OPTIONS'])
+@app.route('/api/download', methods=['POST'])
+@limiter.limit(f'{RATE_LIMIT_PER_HOUR}/hour')
 def download_media():
     """Download Instagram media"""
-    if request.method == 'OPTIONS':
-        return '', 200
-        
     try:
-        # Rate limiting
-        client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if client_ip:
-            client_ip = client_ip.split(',')[0].strip()
-
-        if not check_rate_limit(client_ip):
+        # Rate limiting (ProxyFix already resolved the client IP into remote_addr)
+        if not limiter.enabled and not check_rate_limit(request.remote_addr):
             return jsonify({'status': 'error', 'message': 'Rate limit exceeded. Try again later.'}), 429
 
         # Validate input
@@ -568,11 +1024,12 @@ def download_media():
         # Check if specific item is requested
         item_index = data.get('item_index')
         
-        if not COOKIES_FILE_PATH or not os.path.exists(COOKIES_FILE_PATH):
+        if not COOKIES_AVAILABLE:
             logger.warning("Attempting download without cookies")
 
         # Download
-        result = download_media_ytdlp(url, item_index)
+        # Concurrent requests for the same post share one download
+        result = run_single_flight(('download', get_url_key(url)), download_media_ytdlp, url)
         
         # If specific item is requested, filter results
         if item_index is not None and result.get('files'):
@@ -610,9 +1067,11 @@ def download_media():
 
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"Download error: {error_msg}")
+        logger.error("Download error: %s", error_msg)
         
-        if 'private' in error_msg.lower() or 'login' in error_msg.lower():
+        if 'too large' in error_msg.lower():
+            return jsonify({'status': 'error', 'message': f'Media exceeds the {MAX_FILE_SIZE_MB}MB size limit'}), 413
+        elif 'private' in error_msg.lower() or 'login' in error_msg.lower():
             return jsonify({'status': 'error', 'message': 'This content is private'}), 401
         elif 'not found' in error_msg.lower():
             return jsonify({'status': 'error', 'message': 'Media not found'}), 404
@@ -625,48 +1084,73 @@ def download_media():
         else:
             return jsonify({'status': 'error', 'message': 'Download failed'}), 500
 
+def send_download(file_path):
+    """Send a stored download as an attachment"""
+    mimetype = MIME_TYPES.get(os.path.splitext(file_path)[1].lower(), 'application/octet-stream')
+    # Stored names are unique and never rewritten, so clients may cache them
+    # for as long as the file is kept
+    response = send_file(file_path, mimetype=mimetype, as_attachment=True, download_name=os.path.basename(file_path),
+                         max_age=MAX_FILE_AGE_HOURS * 3600)
+    
+    # nginx wants a URI inside its internal location, not a filesystem path
+    # (304 responses carry no X-Sendfile and are passed through untouched)
+    if X_ACCEL_REDIRECT_PREFIX and response.headers.pop('X-Sendfile', None):
+        response.headers['X-Accel-Redirect'] = f'{X_ACCEL_REDIRECT_PREFIX}/{quote(os.path.basename(file_path))}'
+    return response
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Serve downloaded file"""
     try:
-        safe_filename = sanitize_filename(filename)
-        file_path = os.path.join(DOWNLOAD_FOLDER, safe_filename)
+        # Served names were already sanitized when stored; re-sanitizing here
+        # would append a fresh random suffix, so only reject anything unsafe
+        if filename.startswith('.') or UNSAFE_FILENAME_CHARS_RE.search(filename):
+            return jsonify({'status': 'error', 'message': 'File not found or expired'}), 404
 
-        if not os.path.exists(file_path):
-            # Try to find similar filename
-            base_name = filename.rsplit('_', 1)[0] if '_' in filename else filename
-            matching_files = [f for f in os.listdir(DOWNLOAD_FOLDER) if f.startswith(base_name)]
-            if matching_files:
-                file_path = os.path.join(DOWNLOAD_FOLDER, matching_files[0])
-            else:
-                return jsonify({'status': 'error', 'message': 'File not found or expired'}), 404
+        logger.info("Serving file: %s", filename)
+        # send_file stats the file anyway, so skip a separate exists() check
+        try:
+            return send_download(os.path.join(DOWNLOAD_FOLDER, filename))
+        except FileNotFoundError:
+            pass
 
-        logger.info(f"Serving file: {filename}")
-        return send_file(file_path, as_attachment=True, download_name=os.path.basename(file_path))
+        # Try to find similar filename
+        with _filename_index_lock:
+            matching_files = [name for name in filename_index.get(get_filename_base(filename), ()) if name != filename]
+        if not matching_files:
+            return jsonify({'status': 'error', 'message': 'File not found or expired'}), 404
+        return send_download(os.path.join(DOWNLOAD_FOLDER, matching_files[0]))
 
     except Exception as e:
-        logger.error(f"Error serving file {filename}: {str(e)}")
+        logger.error("Error serving file %s: %s", filename, e)
         return jsonify({'status': 'error', 'message': 'File not available'}), 500
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get service statistics"""
     try:
-        download_files = [f for f in os.listdir(DOWNLOAD_FOLDER) if os.path.isfile(os.path.join(DOWNLOAD_FOLDER, f))]
-        total_size = sum(os.path.getsize(os.path.join(DOWNLOAD_FOLDER, f)) for f in download_files)
+        with _stats_lock:
+            file_count = folder_stats['count']
+            total_size = folder_stats['bytes']
         
-        return jsonify({
+        response = jsonify({
             'status': 'ok',
             'stats': {
-                'cached_files': len(download_files),
+                'cached_files': file_count,
                 'total_size_mb': round(total_size / (1024 * 1024), 2),
                 'max_age_hours': MAX_FILE_AGE_HOURS,
                 'rate_limit_per_hour': RATE_LIMIT_PER_HOUR,
-                'cookies_configured': COOKIES_FILE_PATH is not None
+                # Flask-Limiter's moving window allows the whole hour at once
+                'rate_limit_burst': RATE_LIMIT_PER_HOUR if limiter.enabled else RATE_LIMIT_BURST,
+                'cookies_configured': COOKIES_AVAILABLE
             }
         })
+        # Besides the totals only the cookies state can change (see
+        # refresh_cookies); unchanged polls get an empty 304
+        response.set_etag(f'{file_count}-{total_size}-{int(COOKIES_AVAILABLE)}')
+        return response.make_conditional(request)
     except Exception as e:
-        logger.error(f"Stats error: {str(e)}")
+        logger.error("Stats error: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 # ==================== ERROR HANDLERS ====================
@@ -675,9 +1159,13 @@ def get_stats():
 def not_found(e):
     return jsonify({'status': 'error', 'message': 'Endpoint not found'}), 404
 
+@app.errorhandler(429)
+def rate_limited(e):
+    return jsonify({'status': 'error', 'message': 'Rate limit exceeded. Try again later.'}), 429
+
 @app.errorhandler(500)
 def internal_error(e):
-    logger.error(f"Internal server error: {str(e)}")
+    logger.error("Internal server error: %s", e)
     return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
 # ==================== MAIN ====================
@@ -685,10 +1173,11 @@ def internal_error(e):
 if __name__ == '__main__':
     logger.info("=" * 50)
     logger.info("Instagram Downloader API Starting")
-    logger.info(f"Cookies configured: {COOKIES_FILE_PATH is not None}")
-    logger.info(f"Download folder: {DOWNLOAD_FOLDER}")
-    logger.info(f"Log folder: {LOG_FOLDER}")
+    logger.info("Cookies configured: %s", COOKIES_FILE_PATH is not None)
+    logger.info("Download folder: %s", DOWNLOAD_FOLDER)
+    logger.info("Log folder: %s", LOG_FOLDER)
     logger.info("=" * 50)
     
+    # Local development only - production runs under gunicorn (gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,25 @@
+import os
+
+# Gunicorn configuration for the IGDL API
+# Usage: gunicorn -c gunicorn.conf.py app:app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Requests spend almost all of their time waiting on Instagram, so gevent
+# workers let each process keep many downloads in flight at once
+worker_class = 'gevent'
+worker_connections = 1000
+
+timeout = 120
+
+# Recycle workers periodically to bound any memory creep in long-lived
+# yt-dlp state; the jitter keeps workers from restarting together
+max_requests = 1000
+max_requests_jitter = 50
+
+# Heartbeat files on tmpfs so a slow disk can't make workers look hung
+if os.access('/dev/shm', os.W_OK):
+    worker_tmp_dir = '/dev/shm'
+
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()